@@ -1,6 +1,6 @@
 import cv2
 from .images import *
-from .masks import mask_fill_holes
+from .masks import fill_holes
 
 
 class LikelihoodGenerator:
@@ -87,7 +87,7 @@ class LikelihoodGenerator:
             p1 = p2
 
         mask *= 255
-        mask = mask_fill_holes(mask)
+        mask = fill_holes(mask)
         if file is not None:
             print("Writting file to: " + str(file))
             # TODO: check if folder exists, if not create dir
@@ -2,6 +2,11 @@ import cv2
 import numpy as np
 
 
+# Gray level of every uint8 value of a binary image: 0 to WHITE, others to BLACK
+_BINARY2RGB_LUT = np.zeros(256, dtype=np.uint8)
+_BINARY2RGB_LUT[0] = 255
+
+
 def binary2RGB(image: np.ndarray) -> np.ndarray:
     """
     Convert a binary image to RGB, black & white image
@@ -9,12 +14,12 @@ def binary2RGB(image: np.ndarray) -> np.ndarray:
     :param image: binary image
     :return: binary image coverted to RGB, true values (or 1) to BLACK and other to WHITE
     """
-    img = image.astype(np.uint8)
-    mask = np.zeros(img.shape, dtype=np.uint8)
+    if image.size == 0:
+        # cv2.merge does not accept empty images
+        return np.zeros((image.shape[0], image.shape[1], 3), dtype=np.uint8)
 
-    res = np.zeros((img.shape[0], img.shape[1], 3), dtype=np.uint8)
-    res[np.equal(img, mask)] = (255, 255, 255)
-    return res
+    gray = cv2.LUT(image.astype(np.uint8, copy=False), _BINARY2RGB_LUT)
+    return cv2.merge((gray, gray, gray))
 
 
 def reduce_image(img: np.ndarray, size: int, back_value: int=255) -> np.ndarray:
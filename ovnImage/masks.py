@@ -1,8 +1,6 @@
 import cv2
 import numpy as np
 
-import sklearn.metrics as metrics
-
 
 def bounding_box(mask: np.ndarray):
     """
@@ -29,56 +27,143 @@ def bounding_circle(mask: np.ndarray):
     """
     Get the minium enclosing circle of a given mask
     :param mask:
-    :return: (x, y), r => integers
+    :return: None if it is an empty mask or (x, y), r => integers
     """
-    _, th = cv2.threshold(mask.copy(), 1, 255, cv2.THRESH_BINARY_INV)
-    _, contours, _ = cv2.findContours(th.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
-    cnt = contours[0]
+    points = cv2.findNonZero((mask != 0).view(np.uint8))
+    if points is None:
+        return None
 
-    (x, y), radius = cv2.minEnclosingCircle(cnt)
+    (x, y), radius = cv2.minEnclosingCircle(points)
     center = (int(x), int(y))
     radius = int(radius)
     return center, radius
 
 
-def evaluation(mask: np.ndarray, ground_truth: np.ndarray):
+# Number of set bits of every byte value, used when np.bitwise_count is not available (numpy < 2.0)
+_POPCOUNT_LUT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def pack(mask: np.ndarray) -> np.ndarray:
     """
-    Get the evaluation metrics of a given mask and his likelihood
+    Pack a binary mask to 1 bit per pixel.
+
+    The packed masks can be used with the *_packed functions of this module to keep
+    chained operations over masks 8 times smaller than the uint8 ones.
+
+    :param mask: binary image, non zero values are considered true
+    :return: flat uint8 array with 8 pixels per byte
+    """
+    if mask.dtype.kind not in "biu":
+        mask = mask != 0
+    return np.packbits(mask, axis=None)
+
+
+def unpack(packed: np.ndarray, shape: tuple) -> np.ndarray:
+    """
+    Unpack a mask packed with pack.
+
+    :param packed: uint8 array returned by pack
+    :param shape: shape of the original mask
+    :return: 0, 1 uint8 mask
+    """
+    return np.unpackbits(packed, count=int(np.prod(shape))).reshape(shape)
+
+
+def _popcount(packed: np.ndarray) -> int:
+    """
+    Count the number of set bits of a packed mask.
+
+    :param packed: uint8 array returned by pack
+    :return: number of true pixels
+    """
+    if hasattr(np, "bitwise_count"):
+        return int(np.bitwise_count(packed).sum(dtype=np.int64))
+    return int(_POPCOUNT_LUT[packed].sum(dtype=np.int64))
+
+
+def _check_packed(*packed_masks, size=None):
+    """
+    Check that all the packed masks have the same length, and that it is the length
+    of a mask of the given number of pixels.
+
+    :raise ValueError
+    """
+    lengths = {packed.size for packed in packed_masks}
+    if size is not None:
+        lengths.add((size + 7) // 8)
+    if len(lengths) != 1:
+        raise ValueError("packed masks must come from masks of the same shape")
+
+
+def _confusion_matrix_packed(packed_mask: np.ndarray, packed_ground_truth: np.ndarray, size: int):
+    """
+    Get the binary confusion matrix of two packed masks.
+
+    :param packed_mask: Mask to evaluate packed with pack
+    :param packed_ground_truth: Correct mask packed with pack
+    :param size: number of pixels of the masks
+    :return: tn, fp, fn, tp
+    """
+    tp = _popcount(np.bitwise_and(packed_mask, packed_ground_truth))
+    fp = _popcount(packed_mask) - tp
+    fn = _popcount(packed_ground_truth) - tp
+    tn = size - tp - fp - fn
+    return tn, fp, fn, tp
+
+
+def _confusion_matrix(mask: np.ndarray, ground_truth: np.ndarray):
+    """
+    Get the binary confusion matrix of a mask against its ground truth.
+
+    Only the true positives need a combined pass over both masks, the other values
+    are derived from the number of true pixels of each mask. With numpy >= 2.0 this
+    is done over the bit packed masks using hardware popcount.
+
     :param mask: Binary image => Mask to evaluate
     :param ground_truth: Binary image => Correct mask
-    :raise Incorrect likelihood
-    :return: dict{
-        "FN"
-        "TP"
-        "FP"
-        "Recall"
-        "Precision"
-        "F1"
-        "cohen_kappa"
-        "accuracy"
-    }
+    :return: tn, fp, fn, tp
+    """
+    if mask.shape != ground_truth.shape:
+        raise ValueError("mask and ground truth must have the same shape")
+
+    if hasattr(np, "bitwise_count"):
+        return _confusion_matrix_packed(pack(mask), pack(ground_truth), mask.size)
+
+    tp = np.count_nonzero(np.logical_and(mask, ground_truth))
+    fp = np.count_nonzero(mask) - tp
+    fn = np.count_nonzero(ground_truth) - tp
+    tn = mask.size - tp - fp - fn
+    return int(tn), int(fp), int(fn), int(tp)
+
 
+def _cohen_kappa(tn: int, fp: int, fn: int, tp: int) -> float:
     """
-    stats = {}
+    Get the Cohen's kappa score of a binary confusion matrix.
 
-    likelihood = np.copy(ground_truth).astype(np.uint8)
-    P = np.count_nonzero(ground_truth)  # the number of real positive cases in the data
-    invert_likelihood = np.bitwise_not(likelihood)
-    N = np.count_nonzero(invert_likelihood)  # the number of real negative cases in the data
+    :return: float
+    """
+    n = tn + fp + fn + tp
+    po = (tp + tn) / n
+    pe = ((tp + fn) * (tp + fp) + (fn + tn) * (fp + tn)) / (n * n)
+    if pe == 1:
+        return 0.0
+    return (po - pe) / (1 - pe)
 
-    if N == 0 or P == 0:
-        raise Exception("Incorrect likelihood")
 
-    # pixels identificats com a negatius que haurien de ser positius
-    fn = np.count_nonzero(np.bitwise_and(np.bitwise_not(mask), likelihood))
+def _evaluation_stats(tn: int, fp: int, fn: int, tp: int) -> dict:
+    """
+    Get the evaluation metrics of a binary confusion matrix.
 
-    # pixels identificats com a positius que haurien de ser positius
-    tp = np.count_nonzero(np.bitwise_and(mask, likelihood))
+    :raise Incorrect likelihood
+    :return: dict described in evaluation
+    """
+    stats = {}
 
-    # pixels identificats com a positius que haurien de ser negatius
-    fp = np.count_nonzero(np.bitwise_and(mask, np.bitwise_not(likelihood)))
+    P = tp + fn  # the number of real positive cases in the data
+    N = tn + fp  # the number of real negative cases in the data
 
-    tn = N - fp
+    if N == 0 or P == 0:
+        raise Exception("Incorrect likelihood")
 
     stats["FNR"] = fn / P
     stats["FPR"] = fp / N
@@ -86,48 +171,89 @@ def evaluation(mask: np.ndarray, ground_truth: np.ndarray):
     stats["TPR"] = tp / P
     stats["TNR"] = tn / N
 
-    if stats["TPR"] != 0 or stats["FPR"] != 0:
+    if tp != 0 or fp != 0:
         stats["Precision"] = tp / (tp + fp)
     else:
         stats["Precision"] = 0
 
-    if stats["Precision"] != 0 or stats["TPR"] != 0:
-        stats["F1"] = (2 * stats["Precision"] * stats["TPR"]) / (stats["Precision"] + stats["TPR"])
+    if tp != 0:
+        stats["F1"] = 2 * tp / (2 * tp + fp + fn)
         stats["accuracy"] = (tp + tn) / (P + N)
-        stats["cohen_kappa"] = metrics.cohen_kappa_score(likelihood.flatten(), mask.flatten())
+        stats["cohen_kappa"] = _cohen_kappa(tn, fp, fn, tp)
 
     return stats
 
 
+def evaluation(mask: np.ndarray, ground_truth: np.ndarray):
+    """
+    Get the evaluation metrics of a given mask and his likelihood
+    :param mask: Binary image => Mask to evaluate
+    :param ground_truth: Binary image => Correct mask
+    :raise Incorrect likelihood
+    :return: dict{
+        "FN"
+        "TP"
+        "FP"
+        "Recall"
+        "Precision"
+        "F1"
+        "cohen_kappa"
+        "accuracy"
+    }
+
+    """
+    return _evaluation_stats(*_confusion_matrix(mask, ground_truth))
+
+
+def evaluation_packed(packed_mask: np.ndarray, packed_ground_truth: np.ndarray, size: int):
+    """
+    Same than evaluation, but over masks packed with pack.
+
+    :param packed_mask: Packed binary image => Mask to evaluate
+    :param packed_ground_truth: Packed binary image => Correct mask
+    :param size: number of pixels of the masks
+    :raise Incorrect likelihood
+    :return: dict described in evaluation
+    """
+    _check_packed(packed_mask, packed_ground_truth, size=size)
+    return _evaluation_stats(*_confusion_matrix_packed(packed_mask, packed_ground_truth, size))
+
+
 def sklearn_evaluation(mask: np.ndarray, ground_truth: np.ndarray, pos_label=255):
     """
-    Same than mask_evaluation, but using sklearn library for compute values
+    Same than evaluation, but returning the set of metrics of the sklearn binary evaluation.
+
+    All the values are derived in closed form from the binary confusion matrix, the
+    ratios without any case to compute them are 0.
     :param mask:
     :param ground_truth:
-    :param pos_label: value of the true values
+    :param pos_label: value of the true values, any other value is a false value.
     :return:
+    :raise ValueError: if there are true values in the masks but none is pos_label
     """
-    y_true = ground_truth.flatten()
-    y_pred = mask.flatten()
+    y_pred = mask == pos_label
+    y_true = ground_truth == pos_label
+    if not (y_pred.any() or y_true.any()) and (mask.any() or ground_truth.any()):
+        raise ValueError("pos_label={} is not a value of the masks".format(pos_label))
 
-    tn, fp, fn, tp = metrics.confusion_matrix(y_true, y_pred).ravel()
+    tn, fp, fn, tp = _confusion_matrix(y_pred, y_true)
 
     N = tn + fp
     P = fn + tp
 
-    prfs = metrics.precision_recall_fscore_support(y_true, y_pred, pos_label=pos_label, average="binary")
+    f1 = 2 * tp / (2 * tp + fp + fn) if tp != 0 else 0.0
 
     stats = {
-        "Precision": tp / (tp + fp),
-        "TPR": prfs[1],
-        "TNR": tn / N,
-        "FPR": fp / N,
-        "FNR": fn / P,
-        "Fbeta": prfs[2],
-        "cohen_kappa": metrics.cohen_kappa_score(y_true, y_pred),
+        "Precision": tp / (tp + fp) if tp + fp else 0.0,
+        "TPR": tp / P if P else 0.0,
+        "TNR": tn / N if N else 0.0,
+        "FPR": fp / N if N else 0.0,
+        "FNR": fn / P if P else 0.0,
+        "Fbeta": f1,
+        "cohen_kappa": _cohen_kappa(tn, fp, fn, tp),
         "accuracy": (tp + tn) / (P + N),
-        "r2": metrics.r2_score(y_true, y_pred),
-        "F1": metrics.f1_score(y_true, y_pred, pos_label=pos_label)
+        "r2": 1 - (fp + fn) * (P + N) / (P * N) if P and N else 0.0,
+        "F1": f1
     }
 
     return stats
@@ -144,15 +270,27 @@ def coincidence(mask1, mask2, priority="big_mask"):
     :param mask2:
     :return:
     """
-    mask1 = mask1.astype(np.uint8)
-    mask2 = mask2.astype(np.uint8)
+    if mask1.shape != mask2.shape:
+        raise ValueError("masks must have the same shape")
+
+    return coincidence_packed(pack(mask1), pack(mask2), priority)
+
+
+def coincidence_packed(packed1, packed2, priority="big_mask"):
+    """
+    Same than coincidence, but over masks packed with pack.
 
-    res = np.bitwise_and(mask1, mask2)
+    :param priority:
+    :param packed1:
+    :param packed2:
+    :return:
+    """
+    _check_packed(packed1, packed2)
 
     # number of coincident pixels
-    equals = np.count_nonzero(res)
-    n_pix1 = np.count_nonzero(mask1)
-    n_pix2 = np.count_nonzero(mask2)
+    equals = _popcount(np.bitwise_and(packed1, packed2))
+    n_pix1 = _popcount(packed1)
+    n_pix2 = _popcount(packed2)
 
     if priority == "small_mask":
         max_pix = np.min([n_pix1, n_pix2])
@@ -172,13 +310,29 @@ def onto_mask(mask1, mask2, perc=0.9):
                     to consider that them are one onto the other.
     :return: bool
     """
-    res = np.bitwise_and(mask1.astype(np.bool), mask2.astype(np.bool))
+    if mask1.shape != mask2.shape:
+        raise ValueError("masks must have the same shape")
+
+    return onto_mask_packed(pack(mask1), pack(mask2), perc)
+
+
+def onto_mask_packed(packed1, packed2, perc=0.9):
+    """
+    Same than onto_mask, but over masks packed with pack.
+
+    :param packed1:
+    :param packed2:
+    :param perc: percentage of coincidence pixels that must have the two masks
+                    to consider that them are one onto the other.
+    :return: bool
+    """
+    _check_packed(packed1, packed2)
 
     # number of coincident pixels
-    equals = np.count_nonzero(res)
+    equals = _popcount(np.bitwise_and(packed1, packed2))
 
-    n_pix1 = np.count_nonzero(mask1)
-    n_pix2 = np.count_nonzero(mask2)
+    n_pix1 = _popcount(packed1)
+    n_pix2 = _popcount(packed2)
 
     return equals > (n_pix1 * perc) or equals > (n_pix2 * perc)
 
@@ -187,65 +341,44 @@ def fill_holes(mask):
     """
     Fill all the empty pixels overwhelmed by true pixels.
 
-    :param mask: 0, 255 mask
-    :return: O values inside 255 values are filled with 255
+    :param mask: 0, 255 mask (or 0, 1 mask)
+    :return: O values inside 255 values are filled with 255 (or 1)
     """
-    # Threshold.
-    # Set values equal to or above 220 to 0.
-    # Set values below 220 to 255.
-    mask = mask.copy()
-    # mask = cv2.bitwise_not(mask)
-    if mask.max() == 1:
-        im_th = mask * 255
-
-    else:
-        mask = cv2.bitwise_not(mask)
-        th, im_th = cv2.threshold(mask, 220, 255, cv2.THRESH_BINARY_INV)
-
-    # Copy the thresholded image.
-    im_floodfill = im_th.copy()
+    mask = mask.astype(np.uint8, copy=False)
+    true_value = int(mask.max())
 
     # Mask used to flood filling.
     # Notice the size needs to be 2 pixels than the image.
-    h, w = im_th.shape[:2]
-    mask = np.zeros((h + 2, w + 2), np.uint8)
-
-    # Floodfill from point (0, 0)
-    cv2.floodFill(im_floodfill, mask, (0, 0), 255)
-
-    # Invert floodfilled image
-    im_floodfill_inv = cv2.bitwise_not(im_floodfill)
+    h, w = mask.shape[:2]
+    scratch = np.zeros((h + 2, w + 2), np.uint8)
 
-    # Combine the two images to get the foreground.
-    im_out = im_th | im_floodfill_inv
+    # Floodfill from point (0, 0), only the holes keep the 0 value
+    im_out = mask.copy()
+    cv2.floodFill(im_out, scratch, (0, 0), true_value)
 
-    if mask.max() == 1:
-        im_out = im_out / 255
+    # Invert the floodfilled image and combine it with the mask to get the foreground.
+    np.bitwise_xor(im_out, true_value, out=im_out)
+    np.bitwise_or(im_out, mask, out=im_out)
 
-    return im_out.astype(np.uint8)
+    return im_out
 
 
-def delete_contour_in(mask, region):  # TODO: comment function
+def delete_contour_in(mask, region):
     """
+    Delete the components of a mask bigger than 100 pixels whose centroid is above a given row.
 
-    :param mask:
-    :param region:
-    :return:
+    :param mask: binary image
+    :param region: row of the image, components with the centroid above it are deleted
+    :return: uint8 copy of the mask without the deleted components
     """
     mask = mask.astype(np.uint8)
 
-    _, contours, _ = cv2.findContours(mask.copy(), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    _, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
 
-    for contour in contours:
-
-        area = cv2.contourArea(contour)
-        if area > 100:
-            M = cv2.moments(contour)
-            cx = int(M['m10'] / M['m00'])
-            cy = int(M['m01'] / M['m00'])
-
-            if cy < region:
-                cv2.drawContours(mask, [contour], 0, 0, -1)
+    delete = np.nonzero((stats[:, cv2.CC_STAT_AREA] > 100) & (centroids[:, 1] < region))[0]
+    delete = delete[delete != 0]  # label 0 is the background
+    if delete.size:
+        mask[np.isin(labels, delete)] = 0
 
     return mask
 
@@ -254,24 +387,20 @@ def biggest_connected_component(mask):
     """
     Get the biggest connected component of a mask.
 
+    The size of the components is their number of pixels.
+
     :param mask:
     :return:
     """
-    mask = mask.copy().astype(np.uint8)
-    mask[mask != 0] = np.iinfo(np.uint8).max
+    n_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask.astype(np.uint8, copy=False),
+                                                                  connectivity=8)
+    if n_labels <= 1:
+        return np.zeros(labels.shape, dtype=np.uint8)
 
-    # Find the largest contour and extract it
-    im, contours, hierarchy = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
-    if len(contours) == 0:
-        return mask
+    # label 0 is the background
+    biggest = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
 
-    biggest_cnt = max(contours, key=cv2.contourArea)
-
-    # Create a mask from the largest contour
-    mask = np.zeros_like(mask)
-    cv2.fillPoly(mask, [biggest_cnt], 1)
-
-    return mask
+    return (labels == biggest).view(np.uint8)
 
 
 def every_separated(masks):
@@ -281,7 +410,7 @@ def every_separated(masks):
     :param masks:
     :return:
     """
-    masks = masks.copy().astype(np.uint8)
+    masks = masks.astype(np.uint8)
     masks[masks != 0] = np.iinfo(np.uint8).max
     # Find the largest contour and extract it
     _, contours, _ = cv2.findContours(masks, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
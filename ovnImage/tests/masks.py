@@ -1,38 +1,134 @@
+import os
 import unittest
+from contextlib import contextmanager
 import cv2
 from ..masks import *
+from ..masks import _confusion_matrix
+from ..images import binary2RGB
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+
+
+def read_mask(file_name):
+    """
+    Read a mask of the data folder, black pixels are the true values.
+    """
+    image = cv2.imread(os.path.join(DATA_PATH, file_name), cv2.IMREAD_GRAYSCALE)
+    return (image == 0).astype(np.uint8)
+
+
+@contextmanager
+def without_bitwise_count():
+    """
+    Hide np.bitwise_count to run the code paths used with numpy < 2.0.
+    """
+    bitwise_count = getattr(np, "bitwise_count", None)
+    if bitwise_count is not None:
+        del np.bitwise_count
+    try:
+        yield
+    finally:
+        if bitwise_count is not None:
+            np.bitwise_count = bitwise_count
 
 
 class MasksTestCase(unittest.TestCase):
 
     def setUp(self):
-        self.mask = mask_from_RGB_file("../data/mask.jpg")
-        self.likelihood = mask_from_RGB_file("../data/likelihood.jpg")
-        self.teoric_evaluation = {'cohen_kappa': 0.54313501884871074,
-                                  'Recall': 0.5912653532924077,
-                                  'FN': 0.4087346467075923,
-                                  'Precision': 0.9986451676658918,
-                                  'accuracy': 0.8484160335303632,
-                                  'TP': 0.5912653532924077,
-                                  'FP': 0.0008021522004164241,
-                                  'F1': 0.7427641745748484}
-
-        self.teoric_sklearn_evaluation = {'cohen_kappa': 0.54313501884871074,
-                                          'F1': 0.75953388296686275,
-                                          'Recall': 0.75953388296686275,
-                                          'Fbeta': 0.75953388296686275,
-                                          'accuracy': 0.75953388296686275,
-                                          'Precision': 0.75953388296686275}
+        self.mask = read_mask("mask.jpg")
+        self.likelihood = read_mask("likelihood.jpg")
+        self.teoric_evaluation = {'FNR': 0.4087346467075923,
+                                  'FPR': 0.001939232707924951,
+                                  'TPR': 0.5912653532924077,
+                                  'TNR': 0.998060767292075,
+                                  'Precision': 0.9976916089568906,
+                                  'F1': 0.7425002635838723,
+                                  'accuracy': 0.7595338829668628,
+                                  'cohen_kappa': 0.54313501884871074}
 
 
     def test_evaluation(self):
-        result = mask_evaluation(self.mask, self.likelihood)
-        self.assertEqual(result, self.teoric_evaluation)
+        result = evaluation(self.mask, self.likelihood)
+        self.assertEqual(result.keys(), self.teoric_evaluation.keys())
+        for key, value in self.teoric_evaluation.items():
+            self.assertAlmostEqual(result[key], value, places=12, msg=key)
+
+    def assert_sklearn_stats(self, result, y_pred, y_true, pos_label):
+        from sklearn import metrics
+
+        tn, fp, fn, tp = metrics.confusion_matrix(y_true == pos_label, y_pred == pos_label).ravel()
+        expected = {
+            "Precision": metrics.precision_score(y_true, y_pred, pos_label=pos_label),
+            "TPR": metrics.recall_score(y_true, y_pred, pos_label=pos_label),
+            "TNR": tn / (tn + fp),
+            "FPR": fp / (tn + fp),
+            "FNR": fn / (fn + tp),
+            "Fbeta": metrics.fbeta_score(y_true, y_pred, beta=1, pos_label=pos_label),
+            "cohen_kappa": metrics.cohen_kappa_score(y_true, y_pred),
+            "accuracy": metrics.accuracy_score(y_true, y_pred),
+            "r2": metrics.r2_score(y_true, y_pred),
+            "F1": metrics.f1_score(y_true, y_pred, pos_label=pos_label)
+        }
+        self.assertEqual(result.keys(), expected.keys())
+        for key, value in expected.items():
+            self.assertAlmostEqual(result[key], value, places=12, msg=key)
 
     def test_sklearn_evaluation(self):
-        result = mask_sklearn_evaluation(self.mask, self.likelihood)
+        y_pred = self.mask.ravel()
+        y_true = self.likelihood.ravel()
+
+        result = sklearn_evaluation(self.mask, self.likelihood, pos_label=1)
+        self.assert_sklearn_stats(result, y_pred, y_true, pos_label=1)
+
+        result = sklearn_evaluation(self.mask * 255, self.likelihood * 255)
+        self.assert_sklearn_stats(result, y_pred * 255, y_true * 255, pos_label=255)
+
+        # the black pixels as the true values
+        result = sklearn_evaluation(self.mask, self.likelihood, pos_label=0)
+        self.assert_sklearn_stats(result, y_pred, y_true, pos_label=0)
+
+        with self.assertRaises(ValueError):
+            sklearn_evaluation(self.mask, self.likelihood)
 
-        self.assertEqual(result, self.teoric_sklearn_evaluation)
+    def test_sklearn_evaluation_empty(self):
+        empty = np.zeros_like(self.mask)
+
+        # nothing predicted
+        result = sklearn_evaluation(empty, self.likelihood, pos_label=1)
+        self.assertEqual(result["Precision"], 0.0)
+        self.assertEqual(result["TPR"], 0.0)
+        self.assertEqual(result["FNR"], 1.0)
+        self.assertEqual(result["TNR"], 1.0)
+        self.assertEqual(result["F1"], 0.0)
+        self.assertEqual(result["cohen_kappa"], 0.0)
+
+        # no true values at all
+        result = sklearn_evaluation(empty, empty)
+        self.assertEqual(result["Precision"], 0.0)
+        self.assertEqual(result["TPR"], 0.0)
+        self.assertEqual(result["FNR"], 0.0)
+        self.assertEqual(result["TNR"], 1.0)
+        self.assertEqual(result["r2"], 0.0)
+        self.assertEqual(result["accuracy"], 1.0)
+
+    def test_confusion_matrix_backends(self):
+        mask = self.mask != 0
+        likelihood = self.likelihood != 0
+        expected = (np.count_nonzero(~mask & ~likelihood),
+                    np.count_nonzero(mask & ~likelihood),
+                    np.count_nonzero(~mask & likelihood),
+                    np.count_nonzero(mask & likelihood))
+
+        # bit packed masks with np.bitwise_count when available
+        self.assertEqual(_confusion_matrix(self.mask, self.likelihood), expected)
+        self.assertEqual(_confusion_matrix(self.mask * 255, self.likelihood.astype(bool)), expected)
+
+        # count_nonzero fallback and lookup table popcount
+        with without_bitwise_count():
+            self.assertEqual(_confusion_matrix(self.mask, self.likelihood), expected)
+            self.assertEqual(_confusion_matrix(self.mask * 255, self.likelihood.astype(bool)), expected)
+            self.assertEqual(coincidence_packed(pack(self.mask), pack(self.likelihood)),
+                             expected[3] / max(expected[1] + expected[3], expected[2] + expected[3]))
 
     def test_coincidence(self):
         bool_mask = self.mask.copy()
@@ -42,18 +138,113 @@ class MasksTestCase(unittest.TestCase):
         mask = bool_mask.copy()
         mask[remove_indexs] = 0
 
-        self.assertEqual(round(masks_coincidence(bool_mask, mask), 2), 0.9)
+        self.assertEqual(round(coincidence(bool_mask, mask), 2), 0.9)
 
     def test_onto_mask(self):
 
-        self.assertEqual(mask_onto_mask(self.mask, self.mask), True)
+        self.assertEqual(onto_mask(self.mask, self.mask), True)
 
-    # def test_2RGB(self):
-    #     self.assertEqual(True, False)
+    def test_shape_mismatch(self):
+        mask1 = np.ones((8, 10), dtype=np.uint8)
+        mask2 = np.ones((10, 8), dtype=np.uint8)
+
+        with self.assertRaises(ValueError):
+            coincidence(mask1, mask2)
+        with self.assertRaises(ValueError):
+            onto_mask(mask1, mask2)
+        with self.assertRaises(ValueError):
+            evaluation(mask1, mask2)
+
+    def test_pack(self):
+        packed = pack(self.mask)
+        self.assertEqual(packed.size, (self.mask.size + 7) // 8)
+        self.assertEqual(np.array_equal(unpack(packed, self.mask.shape), self.mask != 0), True)
+
+        # number of pixels not multiple of 8
+        mask = self.mask[:3, :5]
+        packed = pack(mask)
+        self.assertEqual(packed.size, 2)
+        self.assertEqual(np.array_equal(unpack(packed, mask.shape), mask != 0), True)
+
+    def test_packed_functions(self):
+        packed_mask = pack(self.mask)
+        packed_likelihood = pack(self.likelihood)
+
+        tp = np.count_nonzero(np.logical_and(self.mask, self.likelihood))
+        n_mask = np.count_nonzero(self.mask)
+        n_likelihood = np.count_nonzero(self.likelihood)
+        tn = self.mask.size - n_mask - n_likelihood + tp
+
+        stats = evaluation_packed(packed_mask, packed_likelihood, self.mask.size)
+        self.assertEqual(stats["TPR"], tp / n_likelihood)
+        self.assertEqual(stats["TNR"], tn / (self.mask.size - n_likelihood))
+        self.assertEqual(stats["Precision"], tp / n_mask)
+        self.assertEqual(stats["accuracy"], (tp + tn) / self.mask.size)
+        self.assertEqual(stats, evaluation(self.mask, self.likelihood))
+
+        self.assertEqual(coincidence_packed(packed_mask, packed_likelihood),
+                         tp / max(n_mask, n_likelihood))
+        self.assertEqual(coincidence_packed(packed_mask, packed_likelihood, "small_mask"),
+                         tp / min(n_mask, n_likelihood))
+        self.assertEqual(onto_mask_packed(packed_mask, packed_likelihood),
+                         tp > n_mask * 0.9 or tp > n_likelihood * 0.9)
+        self.assertEqual(onto_mask_packed(packed_mask, packed_mask), True)
+
+    def test_packed_functions_not_multiple_of_8(self):
+        mask = np.array([[1, 1, 0, 0, 1],
+                         [0, 1, 0, 1, 1],
+                         [1, 0, 0, 0, 1]], dtype=np.uint8)
+        likelihood = np.array([[1, 0, 0, 0, 1],
+                               [0, 1, 1, 1, 1],
+                               [1, 1, 0, 0, 0]], dtype=np.uint8)
+        packed_mask = pack(mask)
+        packed_likelihood = pack(likelihood)
+
+        stats = evaluation_packed(packed_mask, packed_likelihood, mask.size)
+        self.assertEqual(stats, evaluation(mask, likelihood))
+        # tn = 5 of 7 negatives, tp = 6 of 8 positives
+        self.assertEqual(stats["TNR"], 5 / 7)
+        self.assertEqual(stats["TPR"], 6 / 8)
+        self.assertEqual(coincidence_packed(packed_mask, packed_likelihood), 6 / 8)
+
+    def test_packed_functions_unequal_length(self):
+        packed_mask = pack(self.mask)
+        packed_small = pack(self.mask[:8, :8])
+
+        with self.assertRaises(ValueError):
+            coincidence_packed(packed_mask, packed_small)
+        with self.assertRaises(ValueError):
+            onto_mask_packed(packed_mask, packed_small)
+        with self.assertRaises(ValueError):
+            evaluation_packed(packed_mask, packed_small, self.mask.size)
+        with self.assertRaises(ValueError):
+            evaluation_packed(packed_small, packed_small, self.mask.size)
+
+    def test_2RGB(self):
+        white = np.array([255, 255, 255], dtype=np.uint8)
+        black = np.array([0, 0, 0], dtype=np.uint8)
+
+        for mask in (self.mask, self.mask.astype(bool), self.mask * 255, self.mask.astype(np.float32)):
+            image = binary2RGB(mask)
+            self.assertEqual(image.shape, self.mask.shape + (3,))
+            self.assertEqual(image.dtype, np.uint8)
+            self.assertEqual(np.all(image[self.mask == 0] == white), True)
+            self.assertEqual(np.all(image[self.mask != 0] == black), True)
+
+        # non contiguous view
+        mask = self.mask[::2, ::3]
+        image = binary2RGB(mask)
+        self.assertEqual(image.shape, mask.shape + (3,))
+        self.assertEqual(np.all(image[mask == 0] == white), True)
+        self.assertEqual(np.all(image[mask != 0] == black), True)
+
+        image = binary2RGB(np.zeros((0, 5), dtype=np.uint8))
+        self.assertEqual(image.shape, (0, 5, 3))
+        self.assertEqual(image.dtype, np.uint8)
 
     def test_fill_holes(self):
         mask_ones = self.likelihood.copy()
-        _, contours, _ = cv2.findContours(mask_ones.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+        contours = cv2.findContours(mask_ones.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)[-2]
         for cnt in contours:
             area = cv2.contourArea(cnt)
             if area > 100:
@@ -63,28 +254,50 @@ class MasksTestCase(unittest.TestCase):
                 cv2.circle(mask_ones, center=(cx, cy), radius=2, color=0)
 
         mask_ones_save = mask_ones.copy()
-        mask = mask_fill_holes(mask_ones)
-        self.assertEqual(masks_coincidence(self.likelihood, mask) > 0.99, True)
+        mask = fill_holes(mask_ones)
+        self.assertEqual(coincidence(self.likelihood, mask) > 0.99, True)
+        self.assertEqual(np.all(mask[mask_ones != self.likelihood] == 1), True)
+        self.assertEqual(mask.dtype, np.uint8)
+        self.assertEqual(set(np.unique(mask)), {0, 1})
 
         # mask ones must not be modified
-        self.assertEqual(masks_coincidence(mask_ones, mask_ones_save) > 0.99, True)
+        self.assertEqual(np.array_equal(mask_ones, mask_ones_save), True)
 
         mask_255 = mask_ones * 255
-        mask = mask_fill_holes(mask_255)
-        self.assertEqual(masks_coincidence(self.likelihood, mask) > 0.99, True)
+        mask = fill_holes(mask_255)
+        self.assertEqual(coincidence(self.likelihood, mask) > 0.99, True)
+        self.assertEqual(np.all(mask[mask_ones != self.likelihood] == 255), True)
+        self.assertEqual(mask.dtype, np.uint8)
+        self.assertEqual(set(np.unique(mask)), {0, 255})
 
-    def test_from_RGB_file(self):
-        mask = mask_from_RGB_file("../data/likelihood.jpg")
+    def test_read_mask(self):
+        mask = read_mask("likelihood.jpg")
         self.assertEqual(np.max(mask), 1)
         self.assertEqual(np.min(mask), 0)
 
     def test_bounding_circle(self):
-        center, r = mask_bounding_circle(self.mask)
-        self.assertEqual(center, (314, 274))
-        self.assertEqual(r, 415)
+        center, r = bounding_circle(self.mask)
+        self.assertEqual(center, (334, 307))
+        self.assertEqual(r, 267)
 
-    # def test_delete_contour_in(self):
-    #     self.assertEqual(True, False)
+    def test_bounding_circle_empty(self):
+        self.assertEqual(bounding_circle(np.zeros_like(self.mask)), None)
+
+    def test_delete_contour_in(self):
+        mask = np.zeros((60, 60), dtype=np.uint8)
+        mask[2:14, 5:25] = 1  # big component above the region
+        mask[2:7, 40:45] = 1  # small component above the region
+        mask[40:55, 10:30] = 1  # big component below the region
+        mask_save = mask.copy()
+
+        expected = mask.copy()
+        expected[2:14, 5:25] = 0
+
+        result = delete_contour_in(mask, 30)
+        self.assertEqual(np.array_equal(result, expected), True)
+
+        # mask must not be modified
+        self.assertEqual(np.array_equal(mask, mask_save), True)
 
     # def test_build_circular(self):
     #     self.assertEqual(True, False)
@@ -109,13 +322,31 @@ class MasksTestCase(unittest.TestCase):
         ])
         cv2.fillConvexPoly(mask_drawed, points, 1)
 
-        mask_big_comp = mask_biggest_connected_component(mask_drawed)
+        mask_big_comp = biggest_connected_component(mask_drawed)
 
         # Check if drawed mask hasn't been modified with function
-        self.assertEqual(masks_coincidence(self.likelihood, mask_drawed) < 0.98, True)
+        self.assertEqual(coincidence(self.likelihood, mask_drawed) < 0.98, True)
 
         # Check if biggest connected component is equal than the likelihood
-        self.assertEqual(masks_coincidence(self.likelihood, mask_big_comp) > 0.99, True)
+        self.assertEqual(coincidence(self.likelihood, mask_big_comp) > 0.99, True)
+
+    def test_biggest_connected_component_synthetic(self):
+        mask = np.zeros((40, 50), dtype=np.uint8)
+        mask[5:25, 5:25] = 255
+        mask[10:15, 10:15] = 0  # hole of the biggest component
+        mask[30:35, 40:45] = 255
+
+        expected = np.zeros_like(mask)
+        expected[5:25, 5:25] = 1
+        expected[10:15, 10:15] = 0
+
+        result = biggest_connected_component(mask)
+        self.assertEqual(result.dtype, np.uint8)
+        self.assertEqual(np.array_equal(result, expected), True)
+
+        result = biggest_connected_component(np.zeros_like(mask))
+        self.assertEqual(result.shape, mask.shape)
+        self.assertEqual(np.count_nonzero(result), 0)
 
 
 if __name__ == '__main__':